@@ -1,21 +1,248 @@
+import hashlib
+import os
+import sqlite3
+import time
+from collections import deque
+
 import streamlit as st
 
+# Import SQLAlchemy pieces to build a shared in-memory engine and
+# to reflect the table metadata eagerly
+from sqlalchemy import MetaData, create_engine
+from sqlalchemy.pool import StaticPool
+# Import LangChain community tools specifically for constructing the SQL Agent
+from langchain_community.agent_toolkits.sql.base import create_sql_agent
+# Import utilities for establishing database connections and managing schemas
+from langchain_community.utilities import SQLDatabase
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+# Import the Google Gemini chat model interface
+from langchain_google_genai import ChatGoogleGenerativeAI
+# Import the global LLM cache hook and its SQLite-backed implementation
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
+
+# Module-level flag so the global LLM cache is only installed once per process
+_llm_cache_ready = False
+
+# Terminal verbosity for the agent: set INSIGHTSQL_VERBOSE=1 to get the full
+# thought/action/observation trace on stdout during development. Production
+# stays quiet - the StreamlitCallbackHandler already renders the steps in the
+# UI, and per-line stdout flushing adds wall time on some hosts.
+VERBOSE = os.getenv("INSIGHTSQL_VERBOSE") == "1"
+
+# Registry mapping key digests back to the raw API key.
+# The cached factories below are keyed on the digest, so the raw secret
+# never enters Streamlit's cache-key registry (which may end up in logs
+# or debug dumps); they look the real key up here when building objects.
+_api_keys = {}
+
+def register_api_key(api_key):
+    """
+    Hashes the API Key (BLAKE2, 16-byte digest) and stores the raw key
+    under its digest. Returns the digest, which is what callers should
+    pass to the cached factories instead of the secret itself.
+    """
+    key_id = hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+    _api_keys[key_id] = api_key
+    return key_id
+
 def init_state():
     """
     Initializes the Session State variables if they do not exist.
     This ensures the app has a stable memory structure across re-runs.
     """
-    # Initialize the chat history list
+    # Initialize the chat history.
+    # A bounded deque self-truncates the oldest turns, so memory and
+    # re-render cost stay flat even across very long sessions.
     if "messages" not in st.session_state:
-        st.session_state.messages = []
-    
-    # Initialize the LLM object placeholder
-    if "llm" not in st.session_state:
-        st.session_state.llm = None
-    
-    # Initialize the Database Toolkit placeholder
-    if "toolkit" not in st.session_state:
-        st.session_state.toolkit = None
+        st.session_state.messages = deque(maxlen=200)
+
+    # Install the global LLM response cache (once per process).
+    # Identical (model, prompt) pairs are answered from a local SQLite store,
+    # so the agent's repetitive schema/table-listing prompts skip the Gemini API.
+    global _llm_cache_ready
+    if not _llm_cache_ready:
+        set_llm_cache(SQLiteCache(database_path=".langchain.db"))
+        _llm_cache_ready = True
+
+@st.cache_resource
+def get_llm(key_id):
+    """
+    Builds the Gemini chat model once per API Key and shares it across
+    ALL sessions and re-runs via Streamlit's resource cache.
+    This avoids re-creating the Gemini client (and its HTTP session)
+    on every new user or widget interaction.
+
+    'key_id' is the digest from register_api_key, not the raw secret.
+    """
+    llm = ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        google_api_key=_api_keys[key_id],
+        # Set temperature to 0.3 to ensure the model outputs are deterministic and precise,
+        # which is critical for generating accurate SQL queries.
+        temperature=0.3
+    )
+
+    # Warm the HTTPS channel with a throwaway 1-token call, so the user's
+    # first real question doesn't pay the TCP/TLS handshake on top of
+    # generation. Because this factory is cached, the warmup runs exactly
+    # once per API Key per process.
+    try:
+        llm.invoke("ping", max_output_tokens=1)
+    except Exception:
+        # Warmup is best-effort: a bad key or network issue will surface
+        # with proper error handling on the first real call instead.
+        pass
+
+    return llm
+
+@st.cache_resource
+def get_engine(db_path="dresses.db"):
+    """
+    Copies the SQLite file into an in-memory database once per process and
+    wraps it in a SQLAlchemy engine backed by a StaticPool, so every agent
+    tool call reuses the same in-memory connection instead of paying the
+    file-open and pager overhead of the on-disk database per query.
+    """
+    # Copy the on-disk database into memory (one-time cost at startup)
+    source = sqlite3.connect(db_path)
+    memory = sqlite3.connect(":memory:", check_same_thread=False)
+    source.backup(memory)
+    source.close()
+
+    # StaticPool + creator hands SQLAlchemy the single in-memory connection
+    # and keeps it open between tool calls instead of closing it each time
+    return create_engine(
+        "sqlite://",
+        creator=lambda: memory,
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False}
+    )
+
+@st.cache_resource
+def get_toolkit(key_id, db_path="dresses.db"):
+    """
+    Builds the SQL Toolkit (database connection + tools) once per
+    (API Key digest, database path) pair and caches it across all sessions.
+    This avoids repeating the SQLAlchemy engine setup and schema
+    reflection on every new user.
+    """
+    # Reflect the table metadata once up front and hand it to SQLDatabase,
+    # so it doesn't re-run SQLAlchemy inspect() (PRAGMA table_info etc.)
+    # on instantiation. Since this factory is cached, the reflection cost
+    # is paid exactly once per process.
+    engine = get_engine(db_path)
+    metadata = MetaData()
+    metadata.reflect(bind=engine, only=["dresses"])
+
+    # Wrap the shared in-memory engine in LangChain's SQLDatabase.
+    # Pin the schema to the single 'dresses' table and skip the sample rows
+    # that SQLDatabase embeds in table info by default - this shrinks the
+    # prompt tokens of every schema tool call the agent makes.
+    db = SQLDatabase(
+        engine,
+        metadata=metadata,
+        include_tables=["dresses"],
+        sample_rows_in_table_info=0,
+        view_support=False
+    )
+
+    # Initialize the SQL Toolkit
+    # This provides the Agent with the necessary tools to inspect the schema and execute queries
+    return SQLDatabaseToolkit(db=db, llm=get_llm(key_id))
+
+@st.cache_resource
+def get_agent(key_id):
+    """
+    Builds the SQL Agent Executor once per API Key and caches it.
+    This is the "Brain" that orchestrates the interaction between
+    the LLM and the Database.
+
+    The 'dresses' table schema is baked into the agent prefix so the
+    model can go straight to sql_db_query, skipping the two LLM round
+    trips (list_tables + schema) it would otherwise spend per question.
+    """
+    toolkit = get_toolkit(key_id)
+
+    # Precompute the table info once (cached with the agent) and inject it
+    # into the system prefix so the agent never needs to discover the schema.
+    table_info = toolkit.db.get_table_info()
+    prefix = (
+        "You are an agent designed to interact with a SQLite database. "
+        "The only table is `dresses` with the following schema:\n"
+        f"{table_info}\n"
+        "Given an input question, create a syntactically correct SQLite query, "
+        "run it with the sql_db_query tool, and return the answer. "
+        "Do NOT call the list_tables or schema tools; the schema above is complete. "
+        "Unless the user specifies otherwise, limit results to at most 10 rows. "
+        "Never run any DML statements (INSERT, UPDATE, DELETE, DROP etc.)."
+    )
+
+    return create_sql_agent(
+        llm=get_llm(key_id),
+        toolkit=toolkit,
+        prefix=prefix,
+        top_k=10, # Cap result rows mentioned in the default prompt suffix
+        verbose=VERBOSE,
+        agent_type="tool-calling" # Use Gemini's native Function Calling (Modern & Stable)
+    )
+
+@st.cache_resource
+def _answer_cache():
+    """
+    Process-wide store of recent agent answers, shared by all sessions.
+    Maps (prompt, API Key digest) to (timestamp, answer). This is a plain
+    dict rather than an st.cache_data function because the agent streams
+    into live UI elements (callback container, placeholder) while it
+    runs, and Streamlit's cached-message replay cannot replay writes to
+    elements created outside the cached function - a hit would raise
+    CacheReplayClosureError instead of returning the answer.
+    """
+    return {}
+
+# How long a cached agent answer stays fresh, in seconds
+_ANSWER_TTL = 600
+
+def run_agent_cached(prompt_text, key_id, callbacks=None, placeholder=None):
+    """
+    Runs the SQL Agent for a prompt and caches the final answer for
+    10 minutes, keyed on (prompt, API Key digest). Re-asking the exact
+    same question skips the whole agent loop (LLM calls + SQL execution)
+    and returns the stored answer instantly.
+
+    The callbacks and placeholder are only touched on a miss, when the
+    agent actually runs: the callbacks render the agent's tool steps and
+    the placeholder receives the streamed answer. On a hit neither is used.
+    """
+    cache = _answer_cache()
+    cache_key = (prompt_text, key_id)
+
+    # Try the cache first; serve the answer if it is still fresh
+    entry = cache.get(cache_key)
+    if entry is not None:
+        cached_at, output = entry
+        if time.time() - cached_at < _ANSWER_TTL:
+            return output
+
+    agent_executor = get_agent(key_id)
+
+    # Stream synchronously on the script thread. The async 'astream' path
+    # dispatches sync callbacks onto executor threads, which lack
+    # Streamlit's ScriptRunContext - the StreamlitCallbackHandler trace
+    # would silently stop rendering.
+    output = ""
+    for chunk in agent_executor.stream(
+        {"input": prompt_text},
+        {"callbacks": callbacks or []}
+    ):
+        # Only the final-answer chunks carry an 'output' key;
+        # tool-call and observation chunks are handled by the callbacks.
+        output += chunk.get("output", "")
+        if output and placeholder is not None:
+            placeholder.markdown(output)
+
+    cache[cache_key] = (time.time(), output)
+    return output
 
 def change_on_api_key():
     """
@@ -23,16 +250,14 @@ def change_on_api_key():
     Performs a 'Hard Reset' to ensure the new key is used for future connections.
     """
     # 1. Clear chat history to avoid context mismatch
-    st.session_state.messages = []
-    
-    # 2. Reset the LLM and Toolkit to force re-initialization
-    st.session_state.llm = None
-    st.session_state.toolkit = None
-    
-    # 3. Completely remove the Agent Executor from memory
-    # Using .pop() ensures the key is deleted, forcing the app to rebuild the agent
-    st.session_state.pop("agent_executor", None)
-    
+    st.session_state.messages = deque(maxlen=200)
+
+    # 2. Drop the cached LLM, Toolkit, and Agent so they are rebuilt with the new key
+    get_llm.clear()
+    get_toolkit.clear()
+    get_agent.clear()
+    _answer_cache.clear()
+
     # Notify the user that the system has been reset
     st.toast("API Key updated! System reset.", icon="🔄")
 
@@ -41,8 +266,8 @@ def reset_state():
     Triggered when the user clicks 'Reset Conversation'.
     Performs a 'Soft Reset' (clearing only the chat) while keeping the DB connection alive.
     """
-    # Clear the message history list
-    st.session_state.messages = []
-    
+    # Clear the message history (fresh bounded deque)
+    st.session_state.messages = deque(maxlen=200)
+
     # Notify the user that the chat is clean
-    st.toast("Conversation history cleared!", icon="🧹")
\ No newline at end of file
+    st.toast("Conversation history cleared!", icon="🧹")